@@ -30,15 +30,199 @@
 
 import argparse
 import cv2
+import io
 import numpy as np
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from PIL import Image
 from tqdm import tqdm
 
+# .npy headers keyed by (shape, dtype); each worker process keeps its own cache
+_npy_headers = {}
+
+
+def save_npy(path, arr):
+    """
+    Equivalent of np.save for C-contiguous arrays, writing a cached header and the
+    raw array bytes with a single writev() instead of buffered per-file I/O.
+    """
+    if not hasattr(os, "writev") or not arr.flags.c_contiguous:
+        np.save(path, arr)
+        return
+    key = (arr.shape, arr.dtype.str)
+    header = _npy_headers.get(key)
+    if header is None:
+        buf = io.BytesIO()
+        np.lib.format.write_array_header_1_0(
+            buf, np.lib.format.header_data_from_array_1_0(arr)
+        )
+        header = _npy_headers[key] = buf.getvalue()
+    data = memoryview(arr).cast("B")
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        written = os.writev(fd, [header, data])
+        # writev may write fewer bytes than asked; finish the rest like np.save would
+        if written < len(header):
+            _write_all(fd, memoryview(header)[written:])
+            written = len(header)
+        _write_all(fd, data[written - len(header) :])
+    except BaseException:
+        os.close(fd)
+        os.remove(path)  # never leave a truncated .npy behind
+        raise
+    os.close(fd)
+
+
+def _write_all(fd, buf):
+    while len(buf) > 0:
+        n = os.write(fd, buf)
+        if n == 0:
+            raise OSError(f"write returned 0 with {len(buf)} bytes left")
+        buf = buf[n:]
+
+
+def write_atomic(path, write):
+    """
+    Call write(tmp_path) and move the result to path with os.replace, so a file at
+    path is always complete even if the process dies mid-write.
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.tmp{ext}"  # keep the extension for PIL/np.save
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def is_up_to_date(src_path, dst_path):
+    """
+    Whether dst_path exists and is not older than src_path. Outputs are written with
+    write_atomic, so an existing dst_path is never a partial file.
+    """
+    try:
+        return os.stat(dst_path).st_mtime >= os.stat(src_path).st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def split_line(scene, normal_file):
+    rgb_name = normal_file.replace("normal.exr", "img.png")
+    normal_name = normal_file.replace("normal.exr", "normal.npy")
+    return f"{os.path.join(scene, rgb_name)} {os.path.join(scene, normal_name)}\n"
+
+
+def process_file(scene, file, input_dir, scene_output_dir, incremental=False):
+    """Convert one RGB or normal EXR, return its split file line (None if there is none)."""
+    img_path = os.path.join(input_dir, scene, file)
+
+    # skip conversion if the output is newer than the EXR, keeping its split line
+    if incremental:
+        if "im" in file:
+            out_name = file.replace("im.exr", "img.png")
+        else:
+            out_name = file.replace("normal.exr", "normal.npy")
+        if is_up_to_date(img_path, os.path.join(scene_output_dir, out_name)):
+            return split_line(scene, file) if "normal" in file else None
+
+    im = cv2.imread(
+        img_path, -1
+    )  # im will be an numpy.float32 array of shape (H, W, 3)
+    if im is None:
+        raise IOError(f"cannot read {img_path}")
+    im = cv2.cvtColor(
+        im, cv2.COLOR_BGR2RGB
+    )  # cv2 reads image in BGR shape, convert into RGB
+    # skip if image/normal map contains nan values
+    if np.any(np.isnan(im)):
+        return None
+
+    # if RGB image
+    if "im" in file:
+        im = im.clip(0, 1) ** (
+            1 / 2.2
+        )  # Convert from HDR to LDR with clipping and gamma correction
+        img = (im * 255).astype(np.uint8)
+        img = Image.fromarray(img)
+
+        rgb_name = file.replace("im.exr", "img.png")
+        os.makedirs(scene_output_dir, exist_ok=True)
+        rgb_path = os.path.join(scene_output_dir, rgb_name)
+        write_atomic(rgb_path, img.save)
+        return None
+
+    # invalid pixels are 0
+    # skip if normal map contains invalid values
+    # sum of squares over the contiguous channel axis, without a squared copy
+    norm = np.einsum("hwc,hwc->hw", im, im)[..., None]
+    np.sqrt(norm, out=norm)
+    if np.any(norm < 0.1):
+        return None
+
+    # normalize to unit length (in place, reusing the norm)
+    im /= norm
+
+    # save as .npy
+    normal_name = file.replace("normal.exr", "normal.npy")
+    os.makedirs(scene_output_dir, exist_ok=True)
+    normal_path = os.path.join(scene_output_dir, normal_name)
+    write_atomic(normal_path, lambda tmp_path: save_npy(tmp_path, im))
+
+    return split_line(scene, file)
+
+
+def process_scene(scene, input_dir, output_dir, incremental=False):
+    """
+    Convert the RGB and normal EXRs of one scene, return its split file lines.
+    Files (or a whole scene) that fail to convert are reported and skipped, so one
+    corrupt EXR does not abort the process pool.
+    """
+    lines = []
+    scene_output_dir = os.path.join(output_dir, scene)
+    # read files in inode order, which tracks on-disk layout on ext4/XFS/GPFS and
+    # reduces seeks on cold caches; DirEntry.inode() needs no extra stat() on POSIX
+    try:
+        with os.scandir(os.path.join(input_dir, scene)) as it:
+            files = [entry.name for entry in sorted(it, key=lambda e: e.inode())]
+    except OSError as e:
+        print(f"Warning: skipping scene {scene}: {e}", file=sys.stderr)
+        return lines
+    for file in files:
+        # skip if nor RGB or normals
+        if "im.exr" not in file and "normal.exr" not in file:
+            continue
+        try:
+            line = process_file(scene, file, input_dir, scene_output_dir, incremental)
+        except Exception as e:
+            print(
+                f"Warning: skipping {os.path.join(scene, file)}: {e}", file=sys.stderr
+            )
+            continue
+        if line is not None:
+            lines.append(line)
+    return lines
+
+
 if "__main__" == __name__:
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset_dir", required=True)
     parser.add_argument("--output_dir", required=True)
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes converting scenes in parallel.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Skip files whose output already exists and is newer than the input.",
+    )
 
     args = parser.parse_args()
 
@@ -52,62 +236,18 @@ if "__main__" == __name__:
     if not os.path.exists(scenes85_output_dir):
         os.makedirs(scenes85_output_dir, exist_ok=True)
 
-    with open(os.path.join(output_dir, "interiorverse_filtered_all.txt"), "w+") as f:
-        for scene in tqdm(os.listdir(scenes85_input_dir)):
-            for file in os.listdir(os.path.join(scenes85_input_dir, scene)):
-                # skip if nor RGB or normals
-                if "im.exr" not in file and "normal.exr" not in file:
-                    continue
-
-                img_path = os.path.join(scenes85_input_dir, scene, file)
-                im = cv2.imread(
-                    img_path, -1
-                )  # im will be an numpy.float32 array of shape (H, W, 3)
-                im = cv2.cvtColor(
-                    im, cv2.COLOR_BGR2RGB
-                )  # cv2 reads image in BGR shape, convert into RGB
-                # skip if image/normal map contains nan values
-                if np.any(np.isnan(im)):
-                    continue
-
-                # if RGB image
-                if "im" in file:
-                    im = im.clip(0, 1) ** (
-                        1 / 2.2
-                    )  # Convert from HDR to LDR with clipping and gamma correction
-                    img = (im * 255).astype(np.uint8)
-                    img = Image.fromarray(img)
-
-                    rgb_name = file.replace("im.exr", "img.png")
-                    if not os.path.exists(os.path.join(scenes85_output_dir, scene)):
-                        os.makedirs(
-                            os.path.join(scenes85_output_dir, scene), exist_ok=True
-                        )
-                    rgb_path = os.path.join(scenes85_output_dir, scene, rgb_name)
-                    img.save(rgb_path)
-
-                elif "normal" in file:
-                    # invalid pixels are 0
-                    # skip if normal map contains invalid values
-                    invalid_mask = np.linalg.norm(im, axis=2) < 0.1
-                    if invalid_mask.sum() > 0:
-                        continue
-
-                    # normalize to unit length
-                    im /= np.linalg.norm(im, axis=2, keepdims=True)
-
-                    # save as .npy
-                    normal_name = file.replace("normal.exr", "normal.npy")
-                    if not os.path.exists(os.path.join(scenes85_output_dir, scene)):
-                        os.makedirs(
-                            os.path.join(scenes85_output_dir, scene), exist_ok=True
-                        )
-                    normal_path = os.path.join(scenes85_output_dir, scene, normal_name)
-                    np.save(normal_path, im)
-                    rgb_name = file.replace("normal.exr", "img.png")
-
-                    f.write(
-                        f"{os.path.join(scene, rgb_name)} {os.path.join(scene, normal_name)}\n"
-                    )
+    scenes = os.listdir(scenes85_input_dir)
+    worker = partial(
+        process_scene,
+        input_dir=scenes85_input_dir,
+        output_dir=scenes85_output_dir,
+        incremental=args.incremental,
+    )
+    with open(
+        os.path.join(output_dir, "interiorverse_filtered_all.txt"), "w+"
+    ) as f, ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+        # scenes are decoded in parallel; map() keeps the split file in scene order
+        for lines in tqdm(executor.map(worker, scenes), total=len(scenes)):
+            f.writelines(lines)
 
     print("Preprocess finished")
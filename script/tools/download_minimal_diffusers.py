@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 import argparse
+import importlib.util
 import os
 import sys
-from huggingface_hub import snapshot_download
 
 DEFAULT_ALLOW = [
     "model_index.json",
@@ -57,9 +57,21 @@ def main():
         default=None,
         help="Optional repo revision (branch/tag/commit).",
     )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=8,
+        help="Number of files downloaded concurrently. Default: 8",
+    )
 
     args = parser.parse_args()
 
+    # hf_transfer splits each file into parallel range requests. huggingface_hub reads
+    # this flag at import time and fails if it is set without the package installed.
+    if importlib.util.find_spec("hf_transfer") is not None:
+        os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+    from huggingface_hub import snapshot_download
+
     dest_root = os.path.abspath(args.dest_root)
     local_dir = os.path.join(dest_root, args.model_name)
     os.makedirs(local_dir, exist_ok=True)
@@ -83,6 +95,7 @@ def main():
         allow_patterns=args.allow_patterns,
         ignore_patterns=args.ignore_patterns,
         revision=args.revision,
+        max_workers=args.max_workers,
     )
 
     print("Done.")
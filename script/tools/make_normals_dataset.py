@@ -1,30 +1,67 @@
 #!/usr/bin/env python3
 import argparse
+import json
 import os
 import sys
-import random
-import pathlib
 from typing import List, Tuple, Dict
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import groupby
+import numpy as np
 from tqdm import tqdm
 
 
-def list_image_files(base_dir: str, exts: Tuple[str, ...]) -> List[str]:
+def _scan_dir(
+    dir_path: str, exts: Tuple[str, ...], ext_len: int
+) -> Tuple[List[str], List[str]]:
+    files: List[str] = []
+    subdirs: List[str] = []
+    # DirEntry caches the file type, so no extra stat() per entry
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                # Lowercase only the suffix that can match, not the whole name
+                elif entry.name[-ext_len:].lower().endswith(exts):
+                    files.append(entry.path)
+    except OSError:
+        # Like os.walk, skip directories that cannot be listed
+        return [], []
+    return files, subdirs
+
+
+def list_image_files(
+    base_dir: str, exts: Tuple[str, ...], max_workers: int = 16
+) -> List[str]:
+    # Directory listing is I/O-bound (scandir releases the GIL), so subdirectories
+    # are scanned concurrently on a thread pool.
     collected: List[str] = []
-    for root, _, files in os.walk(base_dir):
-        for f in files:
-            if f.lower().endswith(exts):
-                collected.append(os.path.join(root, f))
+    if not exts:
+        return collected
+    ext_len = max(len(e) for e in exts)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_scan_dir, base_dir, exts, ext_len)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                collected.extend(files)
+                for subdir in subdirs:
+                    pending.add(executor.submit(_scan_dir, subdir, exts, ext_len))
     collected.sort()
     return collected
 
 
 def build_stem_to_relpath_map(files: List[str], rel_root: str) -> Dict[str, str]:
     mapping: Dict[str, str] = {}
+    # All files are listed under rel_root, so a prefix strip replaces os.path.relpath
+    prefix_len = len(rel_root.rstrip(os.sep)) + 1
     for abs_path in files:
-        rel_path = os.path.relpath(abs_path, rel_root)
-        stem = pathlib.Path(rel_path).with_suffix("").as_posix()
-        mapping[stem] = rel_path.replace(os.sep, "/")
+        rel_path = abs_path[prefix_len:].replace(os.sep, "/")
+        dot = rel_path.rfind(".")
+        stem = rel_path[:dot] if dot > rel_path.rfind("/") else rel_path
+        mapping[stem] = rel_path
     return mapping
 
 
@@ -33,13 +70,47 @@ def extract_sample_name(stem: str) -> str:
     Extract the sample name from a stem like 'input/3192_010'.
     For files named {sample_name}_{sample_num}.ext, returns the sample_name part.
     """
-    basename = os.path.basename(stem)
-    # Split by underscore and take all parts except the last one
-    parts = basename.rsplit('_', 1)
-    if len(parts) == 2:
-        return parts[0]
+    _, _, basename = stem.rpartition("/")
+    # Take everything before the last underscore
+    sample_name, sep, _ = basename.rpartition("_")
     # If no underscore, return the whole basename
-    return basename
+    return sample_name if sep else basename
+
+
+def split_path_prefix(subdir: str) -> str:
+    """Return subdir as a '/'-terminated prefix for split file paths ('' if empty)."""
+    subdir = subdir.replace(os.sep, "/").rstrip("/")
+    return f"{subdir}/" if subdir else ""
+
+
+def write_normals_shard(normals: List[Tuple[str, str]], shard_path: str) -> None:
+    """
+    Pack normal NPYs into a single [N, H, W, 3] .npy shard that loaders can memory-map,
+    plus a '<shard>.json' index mapping each split-file normals path to its row.
+    `normals` holds (absolute NPY path, split-file relative path) tuples.
+    """
+    first = np.load(normals[0][0], mmap_mode="r")
+    shard = np.lib.format.open_memmap(
+        shard_path, mode="w+", dtype=first.dtype, shape=(len(normals),) + first.shape
+    )
+    index: Dict[str, int] = {}
+    for i, (abs_path, rel_path) in enumerate(tqdm(normals, desc="Writing shard")):
+        normal = np.load(abs_path)
+        if normal.shape != first.shape:
+            raise ValueError(
+                f"Cannot shard {abs_path}: shape {normal.shape} != {first.shape}"
+            )
+        if normal.dtype != first.dtype:
+            raise ValueError(
+                f"Cannot shard {abs_path}: dtype {normal.dtype} != {first.dtype}"
+            )
+        shard[i] = normal
+        index[rel_path] = i
+    shard.flush()
+    del shard
+
+    with open(os.path.splitext(shard_path)[0] + ".json", "w") as f:
+        json.dump(index, f)
 
 
 def write_split_file(pairs: List[Tuple[str, str]], save_path: str) -> None:
@@ -107,6 +178,14 @@ def main():
         default=".npy",
         help="Comma-separated list of normal file extensions. Default: .npy",
     )
+    parser.add_argument(
+        "--shard_output",
+        type=str,
+        default=None,
+        help="Optional path under dataset_root (e.g., target_shard.npy) to pack all paired "
+        "normal NPYs into one memory-mappable shard with a JSON index next to it. The shard "
+        "is a copy: the original NPY files are kept and are not deleted.",
+    )
 
     args = parser.parse_args()
 
@@ -134,7 +213,12 @@ def main():
     rgb_map = build_stem_to_relpath_map(rgb_files, input_dir)
     normal_map = build_stem_to_relpath_map(normal_files, target_dir)
 
-    common_stems = sorted(set(rgb_map.keys()) & set(normal_map.keys()))
+    # Iterate the smaller map and probe the larger one, avoiding intermediate key sets
+    if len(rgb_map) <= len(normal_map):
+        small_map, big_map = rgb_map, normal_map
+    else:
+        small_map, big_map = normal_map, rgb_map
+    common_stems = sorted(k for k in small_map if k in big_map)
     if len(common_stems) == 0:
         print("Error: No matching pairs found between input and target.", file=sys.stderr)
         sys.exit(1)
@@ -142,19 +226,25 @@ def main():
     # Group pairs by sample name to avoid data leakage
     # For files like "3192_010.png", group by "3192"
     sample_groups: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+
+    # Map values are already '/'-separated, so pairs are built by plain concatenation
+    input_prefix = split_path_prefix(args.input_subdir)
+    target_prefix = split_path_prefix(args.target_subdir)
     
-    for stem in tqdm(common_stems, desc="Building pairs"):
-        rgb_rel = os.path.join(args.input_subdir, rgb_map[stem]).replace(os.sep, "/")
-        normal_rel = os.path.join(args.target_subdir, normal_map[stem]).replace(os.sep, "/")
-        
-        # Extract sample name (e.g., "3192" from "3192_010")
-        sample_name = extract_sample_name(stem)
-        sample_groups[sample_name].append((rgb_rel, normal_rel))
+    # Sorted stems of the same sample (e.g., "3192" from "3192_010") are mostly
+    # adjacent, so each run is added in one sweep. Runs of a sample that are not
+    # adjacent (e.g., in another subdirectory) are merged into the same group.
+    for sample_name, group in groupby(common_stems, key=extract_sample_name):
+        sample_groups[sample_name].extend(
+            (f"{input_prefix}{rgb_map[stem]}", f"{target_prefix}{normal_map[stem]}")
+            for stem in group
+        )
     
     # Get list of unique sample names and shuffle them
     sample_names = sorted(sample_groups.keys())
-    random.seed(args.seed)
-    random.shuffle(sample_names)
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(sample_names))
+    sample_names = [sample_names[i] for i in order.tolist()]
     
     # Split by sample names (not individual pairs) to avoid data leakage
     n_samples = len(sample_names)
@@ -186,9 +276,21 @@ def main():
     # Visualization subset from validation
     n_vis = min(20, len(val_pairs))
     if n_vis > 0:
-        vis_pairs = random.sample(val_pairs, n_vis)
+        vis_idx = rng.choice(len(val_pairs), size=n_vis, replace=False)
+        vis_pairs = [val_pairs[i] for i in vis_idx.tolist()]
         write_split_file(vis_pairs, os.path.join(args.output_split_dir, "vis.txt"))
 
+    if args.shard_output:
+        shard_path = os.path.join(dataset_root, args.shard_output)
+        shard_normals = [
+            (
+                os.path.join(target_dir, normal_map[stem]),
+                f"{target_prefix}{normal_map[stem]}",
+            )
+            for stem in common_stems
+        ]
+        write_normals_shard(shard_normals, shard_path)
+
     n_total_pairs = len(train_pairs) + len(val_pairs) + len(test_pairs)
     print(f"\nDone!")
     print(f"Unique samples: {n_samples} (train: {len(train_sample_names)}, val: {len(val_sample_names)}, test: {len(test_sample_names)})")
@@ -197,6 +299,8 @@ def main():
     if n_vis > 0:
         print(f"Visualization subset: {n_vis} samples written to vis.txt")
     print(f"Split files written to: {os.path.abspath(args.output_split_dir)}")
+    if args.shard_output:
+        print(f"Normals shard written to: {shard_path}")
     print(f"\nNote: Samples with same name (e.g., '3192_010' and '3192_005') are kept in the same split to prevent data leakage.")
 
 
@@ -5,42 +5,111 @@ Check if the same sample name appears in multiple splits.
 For files like "3192_010.png", the sample name is "3192".
 """
 import argparse
+import mmap
 import os
-from collections import defaultdict
-from typing import Dict, List, Set
+from collections import Counter
+from typing import AnyStr, Callable, Dict, Iterable, Iterator, List, Set, Tuple
 
+try:
+    import xxhash
 
-def extract_sample_name(file_path: str) -> str:
+    sample_key: Callable[[bytes], int] = xxhash.xxh3_64_intdigest
+except ImportError:
+    sample_key = hash
+
+
+def extract_sample_name(file_path: AnyStr) -> AnyStr:
     """
     Extract the sample name from a file path like 'input/3192_010.png'.
     Returns the sample_name part (e.g., "3192").
+    Works on both str and undecoded bytes paths.
     """
-    basename = os.path.basename(file_path)
+    if isinstance(file_path, bytes):
+        slash, dot, underscore = b"/", b".", b"_"
+    else:
+        slash, dot, underscore = "/", ".", "_"
+    _, _, basename = file_path.rpartition(slash)
     # Remove extension
-    name_without_ext = os.path.splitext(basename)[0]
-    # Split by underscore and take all parts except the last one
-    parts = name_without_ext.rsplit('_', 1)
-    if len(parts) == 2:
-        return parts[0]
+    name_without_ext, _, _ = basename.rpartition(dot)
+    if not name_without_ext:
+        name_without_ext = basename
+    # Take everything before the last underscore
+    sample_name, sep, _ = name_without_ext.rpartition(underscore)
     # If no underscore, return the whole name
-    return name_without_ext
+    return sample_name if sep else name_without_ext
 
 
-def read_split_file(file_path: str) -> List[str]:
-    """Read a split file and return list of input file paths."""
-    if not os.path.exists(file_path):
-        return []
-    
-    samples = []
-    with open(file_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                # Extract the first part (input file path)
-                parts = line.split()
-                if parts:
-                    samples.append(parts[0])
-    return samples
+def iter_split_samples(file_path: str) -> Iterator[bytes]:
+    """
+    Lazily yield the input file path of each line in a split file.
+    The file is memory-mapped and paths are yielded as undecoded bytes.
+    """
+    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        return
+
+    with open(file_path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        pos = 0
+        size = len(mm)
+        while pos < size:
+            end = mm.find(b"\n", pos)
+            if end < 0:
+                end = size
+            line = mm[pos:end].strip()
+            pos = end + 1
+            if not line:
+                continue
+            # Extract the first part (input file path)
+            sep = line.find(b" ")
+            yield line if sep < 0 else line[:sep]
+
+
+def decode_all(items: Iterable[bytes]) -> List[str]:
+    return [item.decode() for item in items]
+
+
+def collect_examples(
+    file_path: str, sample_names: Set[bytes], limit: int = 3
+) -> Dict[bytes, List[bytes]]:
+    """Collect up to `limit` file paths of a split for each of the given sample names."""
+    examples: Dict[bytes, List[bytes]] = {name: [] for name in sample_names}
+    for sample in iter_split_samples(file_path):
+        files = examples.get(extract_sample_name(sample))
+        if files is not None and len(files) < limit:
+            files.append(sample)
+    return examples
+
+
+def count_sample_names(samples: Iterable[bytes]) -> Tuple[Set[int], Counter]:
+    """
+    Collect the unique sample names of a split and how often each occurs.
+    Names are stored as 64-bit keys (see `sample_key`) rather than as strings.
+    """
+    keys: Set[int] = set()
+    counts: Counter = Counter()
+    for sample in samples:
+        key = sample_key(extract_sample_name(sample))
+        keys.add(key)
+        counts[key] += 1
+    return keys, counts
+
+
+def find_overlap(file_a: str, file_b: str, keys: Set[int]) -> Set[bytes]:
+    """Resolve keys shared by two splits to the sample names present in both."""
+    if not keys:
+        return set()
+
+    def names_for_keys(file_path: str) -> Set[bytes]:
+        names: Set[bytes] = set()
+        for sample in iter_split_samples(file_path):
+            sample_name = extract_sample_name(sample)
+            if sample_key(sample_name) in keys:
+                names.add(sample_name)
+        return names
+
+    # Comparing the actual names guards against hash collisions
+    return names_for_keys(file_a) & names_for_keys(file_b)
 
 
 def main():
@@ -61,58 +130,55 @@ def main():
     val_file = os.path.join(args.split_dir, "val.txt")
     test_file = os.path.join(args.split_dir, "test.txt")
     
-    train_samples = read_split_file(train_file)
-    val_samples = read_split_file(val_file)
-    test_samples = read_split_file(test_file)
+    # Extract sample names, streaming each split file once
+    train_names, train_counts = count_sample_names(iter_split_samples(train_file))
+    val_names, val_counts = count_sample_names(iter_split_samples(val_file))
+    test_names, test_counts = count_sample_names(iter_split_samples(test_file))
     
-    print(f"Train samples: {len(train_samples)}")
-    print(f"Val samples: {len(val_samples)}")
-    print(f"Test samples: {len(test_samples)}")
+    print(f"Train samples: {sum(train_counts.values())}")
+    print(f"Val samples: {sum(val_counts.values())}")
+    print(f"Test samples: {sum(test_counts.values())}")
     print()
     
-    # Extract sample names
-    train_names = {extract_sample_name(s) for s in train_samples}
-    val_names = {extract_sample_name(s) for s in val_samples}
-    test_names = {extract_sample_name(s) for s in test_samples}
-    
     print(f"Unique train sample names: {len(train_names)}")
     print(f"Unique val sample names: {len(val_names)}")
     print(f"Unique test sample names: {len(test_names)}")
     print()
     
     # Check for overlaps
-    train_val_overlap = train_names & val_names
-    train_test_overlap = train_names & test_names
-    val_test_overlap = val_names & test_names
+    train_val_overlap = find_overlap(train_file, val_file, train_names & val_names)
+    train_test_overlap = find_overlap(train_file, test_file, train_names & test_names)
+    val_test_overlap = find_overlap(val_file, test_file, val_names & test_names)
     
     leakage_found = False
     
     if train_val_overlap:
         leakage_found = True
         print(f"⚠️  WARNING: Found {len(train_val_overlap)} sample names in both TRAIN and VAL!")
-        print(f"Examples: {sorted(list(train_val_overlap))[:10]}")
+        print(f"Examples: {decode_all(sorted(list(train_val_overlap))[:10])}")
         print()
         
         # Show specific examples
         print("Detailed examples:")
-        for sample_name in sorted(list(train_val_overlap))[:5]:
-            train_files = [s for s in train_samples if extract_sample_name(s) == sample_name]
-            val_files = [s for s in val_samples if extract_sample_name(s) == sample_name]
-            print(f"  Sample '{sample_name}':")
-            print(f"    Train: {train_files[:3]}")
-            print(f"    Val:   {val_files[:3]}")
+        example_names = sorted(list(train_val_overlap))[:5]
+        train_examples = collect_examples(train_file, set(example_names))
+        val_examples = collect_examples(val_file, set(example_names))
+        for sample_name in example_names:
+            print(f"  Sample '{sample_name.decode()}':")
+            print(f"    Train: {decode_all(train_examples[sample_name])}")
+            print(f"    Val:   {decode_all(val_examples[sample_name])}")
         print()
     
     if train_test_overlap:
         leakage_found = True
         print(f"⚠️  WARNING: Found {len(train_test_overlap)} sample names in both TRAIN and TEST!")
-        print(f"Examples: {sorted(list(train_test_overlap))[:10]}")
+        print(f"Examples: {decode_all(sorted(list(train_test_overlap))[:10])}")
         print()
     
     if val_test_overlap:
         leakage_found = True
         print(f"⚠️  WARNING: Found {len(val_test_overlap)} sample names in both VAL and TEST!")
-        print(f"Examples: {sorted(list(val_test_overlap))[:10]}")
+        print(f"Examples: {decode_all(sorted(list(val_test_overlap))[:10])}")
         print()
     
     if not leakage_found:
@@ -122,10 +188,7 @@ def main():
         return 1
     
     # Show statistics about variations
-    sample_counts: Dict[str, int] = defaultdict(int)
-    for sample in train_samples + val_samples + test_samples:
-        sample_name = extract_sample_name(sample)
-        sample_counts[sample_name] += 1
+    sample_counts = train_counts + val_counts + test_counts
     
     max_variations = max(sample_counts.values())
     min_variations = min(sample_counts.values())
@@ -29,6 +29,7 @@
 # --------------------------------------------------------------------------
 
 import io
+import json
 import numpy as np
 import os
 import random
@@ -56,6 +57,7 @@ class BaseNormalsDataset(Dataset):
         disp_name: str,
         augmentation_args: dict = None,
         resize_to_hw=None,
+        normals_shard: str = None,
         **kwargs,
     ) -> None:
         super().__init__()
@@ -87,6 +89,16 @@ class BaseNormalsDataset(Dataset):
         if self.is_tar:
             self.tar_obj = tarfile.open(self.dataset_dir)
 
+        # Normals packed into one memory-mapped [N, H, W, 3] .npy, indexed by the
+        # normals path of the split file (see script/tools/make_normals_dataset.py)
+        self.normals_shard_path = None
+        self.normals_shard = None
+        if normals_shard is not None:
+            assert not self.is_tar, "Normals shard is not supported for tar datasets"
+            self.normals_shard_path = os.path.join(self.dataset_dir, normals_shard)
+            with open(os.path.splitext(self.normals_shard_path)[0] + ".json") as f:
+                self.normals_shard_index = json.load(f)
+
     def __len__(self):
         return len(self.filenames)
 
@@ -164,7 +176,11 @@ class BaseNormalsDataset(Dataset):
         return rgb
 
     def _read_normals_file(self, rel_path):
-        if self.is_tar:
+        if self.normals_shard_path is not None:
+            if self.normals_shard is None:
+                self.normals_shard = np.load(self.normals_shard_path, mmap_mode="r")
+            normal = np.array(self.normals_shard[self.normals_shard_index[rel_path]])
+        elif self.is_tar:
             if self.tar_obj is None:
                 self.tar_obj = tarfile.open(self.dataset_dir)
             # normal = self.tar_obj.extractfile(f'./{tar_name}/'+rel_path)